@@ -28,7 +28,7 @@ setuptools.setup(
         "importlib_resources",
         "matplotlib",
     ],
-    extras_require={"extra": ["celerite2", "h5py", "black"]},
+    extras_require={"extra": ["celerite2", "h5py", "fitsio", "black"]},
     packages=setuptools.find_packages(where="src", exclude=["data/*, paper/*"]),
     package_dir={"": "src"},
     package_data={
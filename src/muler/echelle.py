@@ -723,17 +723,28 @@ class EchelleSpectrumList(SpectrumList):
         spec_out = copy.deepcopy(self)
         if order_index is None:
             order_index = spec_out.normalization_order_index
-        normalize_by = np.nanmedian(spec_out[order_index].flux.value)
-        for i in range(len(spec_out)):
-            spec_out[i] = spec_out[i].normalize(normalize_by=normalize_by)
+        # Take the median of only the unmasked, finite pixels
+        flux = spec_out[order_index].flux.value
+        if spec_out[order_index].mask is not None:
+            flux = flux[~spec_out[order_index].mask]
+        normalize_by = np.median(flux[flux == flux])
+        if not np.isfinite(normalize_by) or normalize_by == 0.0:
+            log.warn(
+                "The median flux is zero or undefined (all pixels masked), "
+                "normalizing by a tiny value instead."
+            )
+            normalize_by = 1e-20
+        for i, spectrum in enumerate(spec_out):
+            spec_out[i] = spectrum.normalize(normalize_by=normalize_by)
 
         return spec_out
 
     def remove_nans(self):
         """Remove all the NaNs"""
-        spec_out = copy.deepcopy(self)
-        for i in range(len(spec_out)):
-            spec_out[i] = spec_out[i].remove_nans()
+        # Every order gets replaced, so a shallow copy of the list suffices
+        spec_out = copy.copy(self)
+        for i, spectrum in enumerate(spec_out):
+            spec_out[i] = spectrum.remove_nans()
 
         return spec_out
 
@@ -746,16 +757,17 @@ class EchelleSpectrumList(SpectrumList):
             The sigma-clipping threshold (in units of sigma)
         """
         spec_out = copy.deepcopy(self)
-        for i in range(len(spec_out)):
-            spec_out[i] = spec_out[i].remove_outliers(threshold=threshold)
+        for i, spectrum in enumerate(spec_out):
+            spec_out[i] = spectrum.remove_outliers(threshold=threshold)
 
         return spec_out
 
     def trim_edges(self, limits=None):
         """Trim all the edges"""
-        spec_out = copy.deepcopy(self)
-        for i in range(len(spec_out)):
-            spec_out[i] = spec_out[i].trim_edges(limits)
+        # Every order gets replaced, so a shallow copy of the list suffices
+        spec_out = copy.copy(self)
+        for i, spectrum in enumerate(spec_out):
+            spec_out[i] = spectrum.trim_edges(limits)
 
         return spec_out
 
@@ -774,7 +786,10 @@ class EchelleSpectrumList(SpectrumList):
         """Flatten by black body"""
         spec_out = copy.deepcopy(self)
         index = spec_out.normalization_order_index
-        median_wl = copy.deepcopy(np.nanmedian(spec_out[index].wavelength))
+        median_wl = (
+            np.nanmedian(spec_out[index].wavelength.value)
+            * spec_out[index].wavelength.unit
+        )
 
         blackbody_func = BlackBody(temperature=Teff * u.K)
         blackbody_ref = blackbody_func(median_wl)
@@ -796,29 +811,35 @@ class EchelleSpectrumList(SpectrumList):
 
     def to_HDF5(self, path, file_basename):
         """Save all spectral orders to the HDF5 file format"""
-        for i in range(len(self)):
-            self[i].to_HDF5(path, file_basename)
+        for spectrum in self:
+            spectrum.to_HDF5(path, file_basename)
 
     def stitch(self):
         """Stitch all the spectra together, assuming zero overlap in wavelength."""
         spec = copy.deepcopy(self)
-        wls = (
-            np.hstack([spec[i].wavelength.value for i in range(len(spec))])
-            * spec[0].wavelength.unit
-        )
-        fluxes = (
-            np.hstack([spec[i].flux.value for i in range(len(spec))])
-            * spec[0].flux.unit
-        )
+        n_pixels = [len(spectrum.flux) for spectrum in spec]
+        n_total = sum(n_pixels)
+
+        # Fill pre-allocated buffers rather than hstacking lists of Quantities
+        wls = np.empty(n_total, dtype=np.float64)
+        fluxes = np.empty(n_total, dtype=np.float64)
+        offset = 0
+        for spectrum, n in zip(spec, n_pixels):
+            wls[offset : offset + n] = spectrum.wavelength.value
+            fluxes[offset : offset + n] = spectrum.flux.value
+            offset += n
+        wls = wls * spec[0].wavelength.unit
+        fluxes = fluxes * spec[0].flux.unit
+
         if spec[0].uncertainty is not None:
             # HACK We assume if one order has it, they all do, and that it's StdDev
-            unc = np.hstack([spec[i].uncertainty.array for i in range(len(self))])
+            unc = np.hstack([spectrum.uncertainty.array for spectrum in spec])
             unc_out = StdDevUncertainty(unc)
         else:
             unc_out = None
 
         # Stack the x_values:
-        x_values = np.hstack([spec[i].meta["x_values"] for i in range(len(spec))])
+        x_values = np.hstack([spectrum.meta["x_values"] for spectrum in spec])
 
         meta_out = copy.deepcopy(spec[0].meta)
         meta_out["x_values"] = x_values
@@ -827,25 +848,34 @@ class EchelleSpectrumList(SpectrumList):
                 meta_of_meta = spec[0].meta[ancillary_spectrum].meta
                 x_values = np.hstack(
                     [
-                        spec[i].meta[ancillary_spectrum].meta["x_values"]
-                        for i in range(len(spec))
+                        spectrum.meta[ancillary_spectrum].meta["x_values"]
+                        for spectrum in spec
                     ]
                 )
                 meta_of_meta["x_values"] = x_values
             else:
                 meta_of_meta = None
-            wls_anc = np.hstack(
-                [spec[i].meta[ancillary_spectrum].wavelength for i in range(len(spec))]
+            wls_anc = (
+                np.hstack(
+                    [
+                        spectrum.meta[ancillary_spectrum].wavelength.value
+                        for spectrum in spec
+                    ]
+                )
+                * spec[0].meta[ancillary_spectrum].wavelength.unit
             )
-            fluxes_anc = np.hstack(
-                [spec[i].meta[ancillary_spectrum].flux for i in range(len(spec))]
+            fluxes_anc = (
+                np.hstack(
+                    [spectrum.meta[ancillary_spectrum].flux.value for spectrum in spec]
+                )
+                * spec[0].meta[ancillary_spectrum].flux.unit
             )
             if spec[0].meta[ancillary_spectrum].uncertainty is not None:
                 # HACK We assume if one order has it, they all do, and that it's StdDev
                 unc_anc = np.hstack(
                     [
-                        spec[i].meta[ancillary_spectrum].uncertainty.array
-                        for i in range(len(self))
+                        spectrum.meta[ancillary_spectrum].uncertainty.array
+                        for spectrum in spec
                     ]
                 )
                 unc_anc = StdDevUncertainty(unc_anc)
@@ -869,12 +899,12 @@ class EchelleSpectrumList(SpectrumList):
             yhi = np.nanpercentile(self.stitch().flux.value, 90.0) * 1.8
         if not "ax" in kwargs:
             ax = self[0].plot(figsize=(25, 4), ylo=ylo, yhi=yhi, **kwargs)
-            for i in range(1, len(self)):
-                self[i].plot(ax=ax, **kwargs)
+            for spectrum in self[1:]:
+                spectrum.plot(ax=ax, **kwargs)
             return ax
         else:
-            for i in range(1, len(self)):
-                self[i].plot(**kwargs)
+            for spectrum in self[1:]:
+                spectrum.plot(**kwargs)
 
     def __add__(self, other):
         """Bandmath addition"""
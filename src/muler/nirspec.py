@@ -24,7 +24,14 @@ from astropy.constants import R_jup, R_sun, G, M_jup, R_earth, c
 from astropy.time import Time
 
 import os
+import re
 import copy
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fitsio
+except ImportError:
+    fitsio = None
 
 
 log = logging.getLogger(__name__)
@@ -41,6 +48,48 @@ warnings.filterwarnings("ignore", category=FITSFixedWarning)
 # See Issue: https://github.com/astropy/specutils/issues/800
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
+# Only remind the user once per session that NIRSPEC is already sky subtracted
+_SKY_SUBTRACT_WARNED = False
+
+# NSDRP fits tables are named NS.*_<echelle order>_flux_tbl.fits
+NSDRP_FILENAME_PATTERN = re.compile(r"^NS\..*(?P<order>\d{2})_flux_tbl\.fits")
+
+# The NSDRP fits table columns read in by KeckNIRSPECSpectrum
+NSDRP_COLUMNS = ["wave (A)", "flux (cnts)", "noise (cnts)", "sky (cnts)", "col"]
+
+
+def read_nsdrp_header(file):
+    """Read the full header from the _flux.fits sibling of an NSDRP fits table
+
+    Parameters
+    ----------
+    file : (str)
+        A path to a reduced Keck NIRSPEC fits table from NSDRP
+
+    Returns
+    -------
+    header : (astropy.io.fits.Header)
+        The primary header, or None if the sibling file does not exist
+    """
+    fits_with_full_header = file.replace("/fitstbl/", "/fits/").replace(
+        "_flux_tbl.", "_flux."
+    )
+    if os.path.exists(fits_with_full_header):
+        with fits.open(
+            fits_with_full_header, memmap=True, do_not_scale_image_data=True
+        ) as hdu_hdr:
+            return hdu_hdr[0].header
+    else:
+        return None
+
+
+def _uncertainty_in(spec, unit):
+    """The standard deviation uncertainty array of a spectrum, converted to unit"""
+    unc_unit = spec.uncertainty.unit
+    if unc_unit is None:
+        unc_unit = spec.flux.unit
+    return (spec.uncertainty.array * unc_unit).to(unit).value
+
 
 class KeckNIRSPECSpectrum(EchelleSpectrum):
     r"""
@@ -48,9 +97,11 @@ class KeckNIRSPECSpectrum(EchelleSpectrum):
 
     Args:
         file (str): A path to a reduced Keck NIRSPEC spectrum from NSDRP
+        header (astropy.io.fits.Header): An already-read header for this exposure,
+            otherwise the full header is read lazily on first access (optional)
     """
 
-    def __init__(self, *args, file=None, order=63, **kwargs):
+    def __init__(self, *args, file=None, order=63, header=None, **kwargs):
 
         self.site_name = "Keck Observatory"
         # self.ancillary_spectra = ["sky"]
@@ -58,58 +109,58 @@ class KeckNIRSPECSpectrum(EchelleSpectrum):
         self.instrumental_resolution = 20_000.0
 
         if file is not None:
-            file_basename = os.path.basename(file)
+            file = os.fspath(file)
+            match = NSDRP_FILENAME_PATTERN.match(os.path.basename(file))
             assert (
-                file_basename[0:3] == "NS."
-            ), "Only NSDRP spectra are currently supported"
+                match is not None
+            ), "Only NSDRP fits table files are currently supported"
             pipeline = "NSDRP"
-            assert (
-                "_flux_tbl.fits" in file_basename
-            ), "Only fits table files are currently supported"
-            file_stem = file_basename.split("_flux")[0]
-            grating_order = int(file_stem[-2:])
+            grating_order = int(match.group("order"))
 
             assert os.path.exists(file), "The file must exist"
 
-            hdu = fits.open(file)
-            hdu0 = hdu[1]
+            # fitsio (optional) reads the table columns much faster than astropy
+            if fitsio is not None:
+                with fitsio.FITS(file) as fits_file:
+                    data = fits_file[1].read(columns=NSDRP_COLUMNS)
+            else:
+                with fits.open(
+                    file, memmap=True, do_not_scale_image_data=True, lazy_load_hdus=True
+                ) as hdu:
+                    # Copy out native-endian columns before the memory map closes
+                    data = {
+                        column: np.asarray(
+                            hdu[1].data[column],
+                            dtype=hdu[1].data[column].dtype.newbyteorder("="),
+                        )
+                        for column in NSDRP_COLUMNS
+                    }
 
             ## Target Spectrum
-            lamb = hdu0.data["wave (A)"].astype(np.float64) * u.AA
-            flux = hdu0.data["flux (cnts)"].astype(np.float64) * u.ct
-            unc = hdu0.data["noise (cnts)"].astype(np.float64) * u.ct
-
-            uncertainty = StdDevUncertainty(unc)
-            mask = np.array(
-                (
-                    np.isnan(flux)
-                    | np.isnan(uncertainty.array)
-                    | (uncertainty.array <= 0)
-                ),
-                dtype=bool,
-            )
+            # Only copies when the column is not already native float64
+            lamb = np.ascontiguousarray(data["wave (A)"], dtype=np.float64) * u.AA
+            flux_values = np.ascontiguousarray(data["flux (cnts)"], dtype=np.float64)
+            unc_values = np.ascontiguousarray(data["noise (cnts)"], dtype=np.float64)
+            flux = flux_values * u.ct
 
-            # Attempt to read-in the header:
-            fits_with_full_header = file.replace("/fitstbl/", "/fits/").replace(
-                "_flux_tbl.", "_flux."
-            )
-            if os.path.exists(fits_with_full_header):
-                hdu_hdr = fits.open(fits_with_full_header)
-                hdr = hdu_hdr[0].header
-            else:
-                hdr = None
+            uncertainty = StdDevUncertainty(unc_values * u.ct)
+            # ~(unc > 0) is True for both NaN and non-positive uncertainties
+            mask = np.isnan(flux_values) | ~(unc_values > 0)
 
             meta_dict = {
-                "x_values": hdu0.data["col"].astype(np.int),
+                "x_values": data["col"].astype(np.int32, copy=False),
                 "pipeline": pipeline,
                 "m": grating_order,
-                "header": hdr,
+                "header": header,
             }
+            # Defer reading the header until it is first needed
+            if header is None:
+                meta_dict["file"] = file
 
             super().__init__(
                 spectral_axis=lamb,
                 flux=flux,
-                mask=mask.astype(bool),
+                mask=mask,
                 wcs=None,
                 uncertainty=uncertainty,
                 meta=meta_dict,
@@ -117,14 +168,15 @@ class KeckNIRSPECSpectrum(EchelleSpectrum):
             )
 
             ## Sky Spectrum
-            flux = hdu0.data["sky (cnts)"].astype(np.float64) * u.ct
+            # The sky shares the target's spectral axis, uncertainty, and mask arrays
+            sky_flux = np.ascontiguousarray(data["sky (cnts)"], dtype=np.float64)
 
             sky_spectrum = KeckNIRSPECSpectrum(
-                spectral_axis=lamb,
-                flux=flux,
-                mask=mask.astype(bool),
+                spectral_axis=self.spectral_axis,
+                flux=sky_flux * u.ct,
+                mask=self.mask,
                 wcs=None,
-                uncertainty=uncertainty,
+                uncertainty=self.uncertainty,
                 meta=meta_dict.copy(),
                 **kwargs,
             )
@@ -153,20 +205,35 @@ class KeckNIRSPECSpectrum(EchelleSpectrum):
         """Flat spectrum stored as its own KeckNIRSPECSpectrum object"""
         return self.meta["flat"]
 
+    @property
+    def header(self):
+        """The full fits header, read from the _flux.fits sibling on first access
+
+        The header read from disk is cached on this object, leaving its meta untouched.
+        """
+        if self.meta.get("header") is not None:
+            return self.meta["header"]
+        if not hasattr(self, "_lazy_header"):
+            if self.meta.get("file") is not None:
+                self._lazy_header = read_nsdrp_header(self.meta["file"])
+            else:
+                self._lazy_header = None
+        return self._lazy_header
+
     @property
     def RA(self):
         """The right ascension from header files"""
-        return self.meta["header"]["RA"] * u.hourangle
+        return self.header["RA"] * u.hourangle
 
     @property
     def DEC(self):
         """The declination from header files"""
-        return self.meta["header"]["DEC"] * u.deg
+        return self.header["DEC"] * u.deg
 
     @property
     def astropy_time(self):
         """The astropy time based on the header"""
-        mjd = self.meta["header"]["MJD-OBS"]
+        mjd = self.header["MJD-OBS"]
         return Time(mjd, format="mjd", scale="utc")
 
     def sky_subtract(self, force=False):
@@ -177,6 +244,7 @@ class KeckNIRSPECSpectrum(EchelleSpectrum):
         sky_subtractedSpec : (KeckNIRSPECSpectrum)
             Sky subtracted Spectrum
         """
+        global _SKY_SUBTRACT_WARNED
         if force:
             log.warn(
                 "NIRSPEC data are already natively sky subtracted! "
@@ -184,10 +252,12 @@ class KeckNIRSPECSpectrum(EchelleSpectrum):
             )
             return self.subtract(self.sky, handle_meta="first_found")
         else:
-            log.error(
-                "NIRSPEC data are already natively sky subtracted! "
-                "To proceed anyway, state `force=True`."
-            )
+            if not _SKY_SUBTRACT_WARNED:
+                log.error(
+                    "NIRSPEC data are already natively sky subtracted! "
+                    "To proceed anyway, state `force=True`."
+                )
+                _SKY_SUBTRACT_WARNED = True
             return self
 
 
@@ -211,13 +281,194 @@ class KeckNIRSPECSpectrumList(EchelleSpectrumList):
         file : (str)
             A path to a reduced KeckNIRSPEC spectrum from plp
         """
+        files = [os.fspath(file) for file in files]
         n_orders = len(files)
-
-        list_out = []
         for i in range(n_orders):
             assert (
-                files[i].find("_flux_tbl.fits") != -1
-            ), "{} should be a fits_tbl".format(files[i])
-            spec = KeckNIRSPECSpectrum(file=files[i])
+                NSDRP_FILENAME_PATTERN.match(os.path.basename(files[i])) is not None
+            ), "{} should be an NSDRP fits_tbl".format(files[i])
+
+        # Each order reads its own _flux.fits header lazily, on first access
+        def read_order(file):
+            return KeckNIRSPECSpectrum(file=file)
+
+        # The orders are independent, so read them concurrently; map keeps the order
+        with ThreadPoolExecutor(max_workers=max(1, min(8, n_orders))) as executor:
+            list_out = list(executor.map(read_order, files))
+        return KeckNIRSPECSpectrumList(list_out)
+
+    @staticmethod
+    def read_hdf5(path):
+        """Read in a SpectrumList previously saved with `write_hdf5`
+
+        Each stacked dataset is read in one call, and the orders are views into
+        those shared arrays, which is much faster than re-parsing the FITS tables.
+
+        Parameters
+        ----------
+        path : (str)
+            A path to an HDF5 file written by KeckNIRSPECSpectrumList.write_hdf5
+        """
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("You need to install h5py to read the HDF5 format.")
+
+        with h5py.File(path, "r") as f:
+            wavelength = f["wavelength"][:]
+            flux = f["flux"][:]
+            uncertainty = f["uncertainty"][:]
+            mask = f["mask"][:]
+            sky_flux = f["sky_flux"][:]
+            sky_uncertainty = f["sky_uncertainty"][:]
+            sky_mask = f["sky_mask"][:]
+            has_uncertainty = f["has_uncertainty"][:]
+            has_sky = f["has_sky"][:]
+            has_sky_uncertainty = f["has_sky_uncertainty"][:]
+            x_values = f["x_values"][:]
+            n_pixels = f["n_pixels"][:]
+            grating_orders = f["m"][:]
+            headers = list(f["header"].asstr()[:])
+            wavelength_unit = u.Unit(f.attrs["wavelength_unit"])
+            flux_unit = u.Unit(f.attrs["flux_unit"])
+            pipeline = f.attrs["pipeline"]
+
+        list_out = []
+        for i in range(len(n_pixels)):
+            n = n_pixels[i]
+            lamb = u.Quantity(wavelength[i, :n], wavelength_unit, copy=False)
+            if has_uncertainty[i]:
+                unc = StdDevUncertainty(
+                    u.Quantity(uncertainty[i, :n], flux_unit, copy=False)
+                )
+            else:
+                unc = None
+            if headers[i] != "":
+                hdr = fits.Header.fromstring(headers[i])
+            else:
+                hdr = None
+            meta_dict = {
+                "x_values": x_values[i, :n],
+                "pipeline": pipeline,
+                "m": int(grating_orders[i]),
+                "header": hdr,
+            }
+            spec = KeckNIRSPECSpectrum(
+                spectral_axis=lamb,
+                flux=u.Quantity(flux[i, :n], flux_unit, copy=False),
+                mask=mask[i, :n],
+                wcs=None,
+                uncertainty=unc,
+                meta=meta_dict,
+            )
+            if has_sky[i]:
+                if has_sky_uncertainty[i]:
+                    sky_unc = StdDevUncertainty(
+                        u.Quantity(sky_uncertainty[i, :n], flux_unit, copy=False)
+                    )
+                else:
+                    sky_unc = None
+                spec.meta["sky"] = KeckNIRSPECSpectrum(
+                    spectral_axis=spec.spectral_axis,
+                    flux=u.Quantity(sky_flux[i, :n], flux_unit, copy=False),
+                    mask=sky_mask[i, :n],
+                    wcs=None,
+                    uncertainty=sky_unc,
+                    meta=meta_dict.copy(),
+                )
             list_out.append(spec)
         return KeckNIRSPECSpectrumList(list_out)
+
+    def write_hdf5(self, path):
+        """Save all spectral orders to a single HDF5 file of stacked arrays
+
+        The orders are stored as NaN-padded (n_orders, n_pix) datasets, chunked
+        by order, for fast reloading with `KeckNIRSPECSpectrumList.read_hdf5`.
+        Every order, and its sky spectrum, is converted to the wavelength and flux
+        units of the first order.  Use `to_HDF5` for the per-order files expected
+        by Starfish.
+
+        Parameters
+        ----------
+        path : (str)
+            The destination path for the HDF5 file
+        """
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("You need to install h5py to export to the HDF5 format.")
+
+        if len(self) == 0:
+            raise ValueError("Cannot write an empty spectrum list to HDF5.")
+        for spec in self:
+            if (spec.meta is None) or ("x_values" not in spec.meta):
+                raise ValueError(
+                    "Every order needs its native pixel locations in meta['x_values'] "
+                    "to be written to HDF5."
+                )
+
+        # All orders are written in the units of the first order
+        wavelength_unit = self[0].wavelength.unit
+        flux_unit = self[0].flux.unit
+
+        n_orders = len(self)
+        n_pixels = np.array([len(spec.flux) for spec in self])
+        n_pix = n_pixels.max()
+        shape = (n_orders, n_pix)
+
+        # Pad the shorter orders out to the longest one
+        stacked = {
+            "wavelength": np.full(shape, np.nan),
+            "flux": np.full(shape, np.nan),
+            "uncertainty": np.full(shape, np.nan),
+            "mask": np.ones(shape, dtype=bool),
+            "x_values": np.full(shape, -1, dtype=np.int32),
+            "sky_flux": np.full(shape, np.nan),
+            "sky_uncertainty": np.full(shape, np.nan),
+            "sky_mask": np.ones(shape, dtype=bool),
+        }
+        has_uncertainty = np.zeros(n_orders, dtype=bool)
+        has_sky = np.zeros(n_orders, dtype=bool)
+        has_sky_uncertainty = np.zeros(n_orders, dtype=bool)
+        for i, spec in enumerate(self):
+            n = n_pixels[i]
+            stacked["wavelength"][i, :n] = spec.wavelength.to(wavelength_unit).value
+            stacked["flux"][i, :n] = spec.flux.to(flux_unit).value
+            stacked["x_values"][i, :n] = spec.meta["x_values"]
+            if spec.mask is not None:
+                stacked["mask"][i, :n] = spec.mask
+            else:
+                stacked["mask"][i, :n] = False
+            if spec.uncertainty is not None:
+                has_uncertainty[i] = True
+                stacked["uncertainty"][i, :n] = _uncertainty_in(spec, flux_unit)
+            if "sky" in spec.meta:
+                sky = spec.meta["sky"]
+                has_sky[i] = True
+                stacked["sky_flux"][i, :n] = sky.flux.to(flux_unit).value
+                if sky.mask is not None:
+                    stacked["sky_mask"][i, :n] = sky.mask
+                else:
+                    stacked["sky_mask"][i, :n] = False
+                if sky.uncertainty is not None:
+                    has_sky_uncertainty[i] = True
+                    stacked["sky_uncertainty"][i, :n] = _uncertainty_in(sky, flux_unit)
+
+        headers = [
+            spec.header.tostring() if spec.header is not None else "" for spec in self
+        ]
+
+        with h5py.File(path, "w") as f:
+            for name, data in stacked.items():
+                f.create_dataset(name, data=data, chunks=(1, n_pix), compression="lzf")
+            f.create_dataset("has_uncertainty", data=has_uncertainty)
+            f.create_dataset("has_sky", data=has_sky)
+            f.create_dataset("has_sky_uncertainty", data=has_sky_uncertainty)
+            f.create_dataset("n_pixels", data=n_pixels)
+            f.create_dataset("m", data=np.array([spec.meta["m"] for spec in self]))
+            f.create_dataset(
+                "header", data=np.array(headers, dtype=h5py.string_dtype())
+            )
+            f.attrs["wavelength_unit"] = wavelength_unit.to_string()
+            f.attrs["flux_unit"] = flux_unit.to_string()
+            f.attrs["pipeline"] = self[0].meta["pipeline"]
@@ -1,13 +1,18 @@
 # from astropy.nddata.ccddata import _uncertainty_unit_equivalent_to_parent
 import pytest
 import time
+import logging
+import muler.nirspec
 from muler.nirspec import KeckNIRSPECSpectrum, KeckNIRSPECSpectrumList
 from specutils import Spectrum1D
 
-# from astropy.nddata.nduncertainty import StdDevUncertainty
+from astropy.nddata.nduncertainty import StdDevUncertainty
 import numpy as np
 import glob
+import os
+from pathlib import Path
 import astropy
+from astropy.io import fits
 from specutils.spectra.spectrum_list import SpectrumList
 
 local_files = glob.glob("**/NS.*_flux_tbl.fits*", recursive=True)
@@ -131,7 +136,193 @@ def test_lists():
 
     speclist = KeckNIRSPECSpectrumList.read(files=local_files)
 
+    # The concurrent read must preserve the order of the input files
+    expected_orders = [
+        int(os.path.basename(f).split("_flux_tbl")[0][-2:]) for f in local_files
+    ]
+    assert [spec.meta["m"] for spec in speclist] == expected_orders
+
     new_speclist = speclist.remove_nans().normalize()
 
     assert new_speclist is not None
     assert isinstance(new_speclist, SpectrumList)
+
+
+def test_hdf5_roundtrip(tmp_path):
+    """Can we save and reload a list of orders with HDF5?"""
+    pytest.importorskip("h5py")
+
+    speclist = KeckNIRSPECSpectrumList.read(files=local_files).remove_nans()
+    # An order without uncertainties should come back without them
+    speclist[-1] = speclist[-1]._copy(uncertainty=None)
+    # The sky keeps its own uncertainty, distinct from the target's
+    sky = speclist[0].meta["sky"]
+    speclist[0].meta["sky"] = sky._copy(
+        uncertainty=StdDevUncertainty(2.0 * sky.uncertainty.array)
+    )
+    path = str(tmp_path / "nirspec_orders.hdf5")
+    speclist.write_hdf5(path)
+
+    new_speclist = KeckNIRSPECSpectrumList.read_hdf5(path)
+
+    assert isinstance(new_speclist, KeckNIRSPECSpectrumList)
+    assert len(new_speclist) == len(speclist)
+    for old_spec, new_spec in zip(speclist, new_speclist):
+        assert np.allclose(new_spec.flux.value, old_spec.flux.value)
+        assert np.allclose(new_spec.wavelength.value, old_spec.wavelength.value)
+        assert np.all(new_spec.mask == old_spec.mask)
+        assert np.all(new_spec.meta["x_values"] == old_spec.meta["x_values"])
+        assert new_spec.meta["x_values"].dtype == np.int32
+        assert new_spec.meta["m"] == old_spec.meta["m"]
+        assert new_spec.RA == old_spec.RA
+        assert np.allclose(new_spec.sky.flux.value, old_spec.sky.flux.value)
+        assert np.all(new_spec.sky.mask == old_spec.sky.mask)
+        assert np.allclose(
+            new_spec.sky.uncertainty.array, old_spec.sky.uncertainty.array
+        )
+        if old_spec.uncertainty is None:
+            assert new_spec.uncertainty is None
+        else:
+            assert np.allclose(new_spec.uncertainty.array, old_spec.uncertainty.array)
+
+    with pytest.raises(ValueError):
+        KeckNIRSPECSpectrumList([]).write_hdf5(path)
+
+    del speclist[0].meta["x_values"]
+    with pytest.raises(ValueError):
+        speclist.write_hdf5(path)
+
+
+def assert_same_spectrum(spec1, spec2):
+    """Assert that two NIRSPEC spectra hold identical data"""
+    assert np.array_equal(spec1.wavelength.value, spec2.wavelength.value)
+    assert np.array_equal(spec1.flux.value, spec2.flux.value, equal_nan=True)
+    assert np.array_equal(
+        spec1.uncertainty.array, spec2.uncertainty.array, equal_nan=True
+    )
+    assert np.array_equal(spec1.mask, spec2.mask)
+    assert np.array_equal(spec1.meta["x_values"], spec2.meta["x_values"])
+    assert np.array_equal(spec1.sky.flux.value, spec2.sky.flux.value, equal_nan=True)
+
+
+def test_fitsio_matches_astropy(monkeypatch):
+    """Do the fitsio and astropy read paths give the same spectrum?"""
+    pytest.importorskip("fitsio")
+
+    spec_fitsio = KeckNIRSPECSpectrum(file=file)
+
+    monkeypatch.setattr(muler.nirspec, "fitsio", None)
+    spec_astropy = KeckNIRSPECSpectrum(file=file)
+
+    assert_same_spectrum(spec_fitsio, spec_astropy)
+
+
+def test_astropy_memmap_read(monkeypatch):
+    """Does the memory-mapped astropy fallback copy out the right columns?"""
+    monkeypatch.setattr(muler.nirspec, "fitsio", None)
+    spec = KeckNIRSPECSpectrum(file=file)
+
+    with fits.open(file, memmap=False) as hdus:
+        table = hdus[1].data
+        wavelength = np.array(table["wave (A)"], dtype=np.float64)
+        flux = np.array(table["flux (cnts)"], dtype=np.float64)
+        sky_flux = np.array(table["sky (cnts)"], dtype=np.float64)
+        x_values = np.array(table["col"])
+
+    assert spec.flux.value.dtype.isnative
+    assert np.array_equal(spec.wavelength.value, wavelength)
+    assert np.array_equal(spec.flux.value, flux, equal_nan=True)
+    assert np.array_equal(spec.sky.flux.value, sky_flux, equal_nan=True)
+    assert np.array_equal(spec.meta["x_values"], x_values)
+
+    # The columns must stay valid after the file is closed
+    assert np.isfinite(np.nansum(spec.flux.value))
+
+
+def test_list_normalize():
+    """Does list normalization use the median of the unmasked pixels?"""
+    speclist = KeckNIRSPECSpectrumList.read(files=local_files)
+
+    flux = speclist[0].flux.value
+    good = ~speclist[0].mask & np.isfinite(flux)
+    expected = np.median(flux[good])
+
+    new_speclist = speclist.normalize()
+    for old_spec, new_spec in zip(speclist, new_speclist):
+        assert np.allclose(
+            new_spec.flux.value, old_spec.flux.value / expected, equal_nan=True
+        )
+
+    # A fully-masked or all-zero reference order falls back to a tiny divisor
+    n_pix = len(speclist[0].flux)
+    for bad_spec in [
+        speclist[0]._copy(mask=np.ones(n_pix, dtype=bool)),
+        speclist[0]._copy(flux=np.zeros(n_pix) * speclist[0].flux.unit),
+    ]:
+        bad_speclist = KeckNIRSPECSpectrumList([bad_spec] + list(speclist[1:]))
+        new_speclist = bad_speclist.normalize()
+        assert np.allclose(
+            new_speclist[1].flux.value,
+            speclist[1].flux.value / 1e-20,
+            equal_nan=True,
+        )
+
+
+def test_filenames():
+    """Are NSDRP filenames validated, and are Path objects accepted?"""
+    with pytest.raises(AssertionError):
+        KeckNIRSPECSpectrum(file="data/not_a_nirspec_file.fits")
+    with pytest.raises(AssertionError):
+        KeckNIRSPECSpectrumList.read(files=["data/not_a_nirspec_file.fits"])
+
+    spec = KeckNIRSPECSpectrum(file=Path(file))
+    assert spec.meta["m"] == KeckNIRSPECSpectrum(file=file).meta["m"]
+
+    speclist = KeckNIRSPECSpectrumList.read(files=[Path(f) for f in local_files])
+    assert len(speclist) == len(local_files)
+
+
+def test_sky_subtract_logs_once(monkeypatch, caplog):
+    """Is the already-sky-subtracted error only logged once?"""
+    monkeypatch.setattr(muler.nirspec, "_SKY_SUBTRACT_WARNED", False)
+    spec = KeckNIRSPECSpectrum(file=file)
+
+    with caplog.at_level(logging.ERROR, logger="muler.nirspec"):
+        assert spec.sky_subtract() is spec
+        assert spec.sky_subtract() is spec
+
+    errors = [record for record in caplog.records if record.levelno == logging.ERROR]
+    assert len(errors) == 1
+    assert "already natively sky subtracted" in errors[0].getMessage()
+
+
+def test_list_headers():
+    """Does each order carry the header from its own _flux.fits file?"""
+    speclist = KeckNIRSPECSpectrumList.read(files=local_files)
+
+    for spec, table_file in zip(speclist, local_files):
+        header_file = table_file.replace("/fitstbl/", "/fits/").replace(
+            "_flux_tbl.", "_flux."
+        )
+        if os.path.exists(header_file):
+            expected = fits.getheader(header_file)
+            assert spec.header.tostring() == expected.tostring()
+        else:
+            assert spec.header is None
+
+    headers = [spec.header for spec in speclist if spec.header is not None]
+    assert len(set(map(id, headers))) == len(headers)
+
+
+def test_lazy_header():
+    """Is the header only read on first access, without touching meta?"""
+    speclist = KeckNIRSPECSpectrumList.read(files=local_files)
+    spec = speclist[0]
+
+    assert not hasattr(spec, "_lazy_header")
+    meta_keys = set(spec.meta.keys())
+
+    assert isinstance(spec.RA, astropy.units.quantity.Quantity)
+    assert hasattr(spec, "_lazy_header")
+    assert set(spec.meta.keys()) == meta_keys
+    assert spec.meta["file"] == local_files[0]